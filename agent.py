@@ -3,9 +3,8 @@
 Module defining different agents that could play the Battleship game.
 """
 from abc import ABC, abstractmethod
-from typing import Tuple
-from collections import deque
-import random
+from functools import lru_cache
+from typing import Optional, Tuple
 
 import numpy as np
 
@@ -13,15 +12,90 @@ from board import BattleshipAgentBoard
 from data_types import AttackResult, BoardViewConfig
 
 
+# (di, dj) offsets of the 4 neighbours of a cell visited by sink()
+_NEIGHBORS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+@lru_cache(maxsize=4)
+def _make_seek_pattern(n: int, small_side: int, large_side: int) -> np.ndarray:
+    """
+    Seek cells of OptimalAgent as a read-only int32 (K, 2) array: the diagonal cells (r + x, c + x)
+    of every large_side x large_side block, flattened in (r, c, x) loop order.
+
+    Cached, since the consecutive boards of one experiment (n, config) often share the pattern.
+    Only the last few are kept, as a pattern can take ~100 MB on the largest boards.
+    """
+    blocks_r = np.arange(0, n, large_side, dtype=np.int32)
+    blocks_c = np.arange(0, n, large_side, dtype=np.int32)
+    offsets = np.arange(0, large_side, small_side, dtype=np.int32)
+    rs = (blocks_r[:, None, None] + offsets[None, None, :]).repeat(len(blocks_c), axis=1)
+    cs = (blocks_c[None, :, None] + offsets[None, None, :]).repeat(len(blocks_r), axis=0)
+    rs, cs = rs.ravel(), cs.ravel()
+    in_bounds = (rs < n) & (cs < n)
+
+    seek_coords = np.stack((rs[in_bounds], cs[in_bounds]), axis=1)
+    seek_coords.flags.writeable = False
+    return seek_coords
+
+
 class BaseAgent(ABC):
     agent_board: BattleshipAgentBoard
     board_config: BoardViewConfig
-    board: np.array
+    board: np.ndarray
 
-    def __init__(self, agent_board: BattleshipAgentBoard):
+    # Initial length of the sink() BFS queue of the Python fallback
+    SINK_QUEUE_SIZE = 64
+
+    def __init__(self, agent_board: BattleshipAgentBoard, board_buffer: Optional[np.ndarray] = None):
         self.agent_board = agent_board
         self.board_config = self.agent_board.board_config
-        self.board = np.zeros(shape=(self.board_config.n, self.board_config.n))
+        if board_buffer is None:
+            board_buffer = self.make_board_buffer(self.board_config.n)
+        self.board = board_buffer
+        self._sink_queue = np.empty(self.SINK_QUEUE_SIZE, dtype=np.int32)
+
+    @staticmethod
+    def make_board_buffer(n: int) -> np.ndarray:
+        """
+        Allocates the visited board for a board of size {n}, one bool per cell.
+        A buffer may be reused across games once zeroed.
+        """
+        return np.zeros(shape=(n, n), dtype=np.bool_)
+
+    def _sink_bfs(self, ar: int, ac: int) -> Tuple[int, int]:
+        """
+        Python sink() BFS from the hit cell (ar, ac) over the unvisited cells, attacking every
+        cell reached and expanding from the ones that are HIT. Returns the moves taken and ships sunk.
+        """
+        n = self.board_config.n
+        moves = 0
+        ships_sunk = 0
+
+        # BFS queue of packed cell codes (i * n + j). Cells are marked visited before
+        # being queued, so each cell is queued at most once and no wrap-around is needed.
+        # Only ship cells get queued, so the queue is kept across calls and grown on demand.
+        queue = self._sink_queue
+        queue[0] = ar * n + ac
+        head, tail = 0, 1
+        while head < tail:
+            i, j = divmod(int(queue[head]), n)
+            head += 1
+            for di, dj in _NEIGHBORS:
+                ni, nj = i + di, j + dj
+                if 0 <= ni < n and 0 <= nj < n and not self.board[ni, nj]:
+                    result = self.agent_board.attack(ni, nj)
+                    self.board[ni, nj] = True
+                    moves += 1
+
+                    if result == AttackResult.HIT:
+                        if tail == len(queue):
+                            queue = self._sink_queue = np.concatenate((queue, np.empty_like(queue)))
+                        queue[tail] = ni * n + nj
+                        tail += 1
+                    elif result == AttackResult.SUNK:
+                        ships_sunk += 1
+
+        return moves, ships_sunk
 
     @abstractmethod
     def start_game(self) -> Tuple[int, str]:
@@ -46,84 +120,114 @@ class BaseAgent(ABC):
 class BruteForceAgent(BaseAgent):
     """Brute Force Agent"""
 
+    # Number of cells attacked per batch when the compiled scan is unavailable
+    BATCH_CELLS = 1 << 16
+
     def start_game(self) -> Tuple[int, str]:
         total_ships = sum([ship.count for ship in self.board_config.ships])
-        ships_sunk = 0
-        moves = 0
 
-        for r in range(self.board_config.n):
-            for c in range(self.board_config.n):
-                result = self.agent_board.attack(r, c)
-                moves += 1
+        if self.agent_board.scan_attack is not None:
+            # Compiled path: the whole row-major scan runs without the interpreter
+            moves = self.agent_board.scan_attack(total_ships)
+            if moves > 0:
+                return moves, ""
+            if moves < 0:
+                return -1, "INVALID ERROR"
+            return -1, "Unknown Error: Should not have happened"
 
-                if result == AttackResult.INVALID:
-                    return -1, "INVALID ERROR"
+        n = self.board_config.n
+        ships_sunk = 0
 
-                if result == AttackResult.SUNK:
-                    ships_sunk += 1
+        # Attack a block of rows at a time, so memory stays bounded on large boards
+        rows_per_batch = max(1, self.BATCH_CELLS // n)
+        cols = np.arange(n)
+        for r0 in range(0, n, rows_per_batch):
+            rows = np.arange(r0, min(n, r0 + rows_per_batch))
+            rs, cs = np.meshgrid(rows, cols, indexing="ij")
+            results, sunk = self.agent_board.attack_many(rs.ravel(), cs.ravel())
+            invalid = np.flatnonzero(results == AttackResult.INVALID.value)
+
+            if ships_sunk + sunk >= total_ships:
+                sunk_so_far = ships_sunk + np.cumsum(results == AttackResult.SUNK.value)
+                last_move = int(np.searchsorted(sunk_so_far, total_ships))
+                if len(invalid) > 0 and invalid[0] < last_move:
+                    return -1, "INVALID ERROR"
+                return r0 * n + last_move + 1, ""
 
-                if ships_sunk == total_ships:
-                    return moves, ""
+            if len(invalid) > 0:
+                return -1, "INVALID ERROR"
+            ships_sunk += sunk
 
         return -1, "Unknown Error: Should not have happened"
 
 class OptimalAgent(BaseAgent):
     """Our Optimal Algorithmic Agent"""
 
-    def __init__(self, agent_board: BattleshipAgentBoard):
-        super().__init__(agent_board)
-        self.total_ships = sum([ship.count for ship in self.board_config.ships])
+    # Number of seek cells converted to Python ints at a time
+    SEEK_BLOCK = 1 << 12
+
+    def __init__(self, agent_board: BattleshipAgentBoard, board_buffer: Optional[np.ndarray] = None):
+        super().__init__(agent_board, board_buffer)
         self.ships_sunk = 0
         self.moves = 0
-        self.step_size = min(ship.length * ship.breadth for ship in self.board_config.ships)
 
+        # Single pass over the ships for all aggregates used by the agent
+        total_ships = 0
+        min_area = np.inf
         min_small_side = np.inf
         min_large_side = np.inf
         for ship in self.board_config.ships:
-            small_side = min(ship.length, ship.breadth)
-            large_side = max(ship.length, ship.breadth)
+            total_ships += ship.count
+            if ship.length * ship.breadth < min_area:
+                min_area = ship.length * ship.breadth
+
+            if ship.length < ship.breadth:
+                small_side, large_side = ship.length, ship.breadth
+            else:
+                small_side, large_side = ship.breadth, ship.length
             if small_side < min_small_side or large_side < min_large_side:
                 min_small_side, min_large_side = small_side, large_side
 
+        self.total_ships = total_ships
+        self.step_size = min_area
         self.small_side = min_small_side
         self.large_side = min_large_side
         # print(f"Min sized ship: {self.large_side}x{self.small_side}")
 
+        self._seek_coords = _make_seek_pattern(self.board_config.n, self.small_side, self.large_side)
+
     def seek(self) -> bool:
         """Seeks ships using a checkerboard-style search based on the smallest ship size."""
-        for r in range(0, self.board_config.n, self.large_side):
-            for c in range(0, self.board_config.n, self.large_side):
-                for x in range(0, self.large_side, self.small_side):
-                    ar, ac = r + x, c + x
-                    if 0 <= ar < self.board_config.n and 0 <= ac < self.board_config.n and self.board[ar, ac] == 0:
-                        result = self.agent_board.attack(ar, ac)
-                        self.moves += 1
-                        self.board[ar, ac] = 1  # Mark as visited
+        # Convert the pattern to Python ints a block at a time: large boards have millions of
+        # seek cells, and most games finish long before the end of the pattern
+        for start in range(0, len(self._seek_coords), self.SEEK_BLOCK):
+            for ar, ac in self._seek_coords[start:start + self.SEEK_BLOCK].tolist():
+                if not self.board[ar, ac]:
+                    result = self.agent_board.attack(ar, ac)
+                    self.moves += 1
+                    self.board[ar, ac] = True
 
-                        if result == AttackResult.HIT:
-                            self.sink(ar, ac)
+                    if result == AttackResult.HIT:
+                        self.sink(ar, ac)
 
-                        if self.ships_sunk == self.total_ships:
-                            return True
+                    if self.ships_sunk == self.total_ships:
+                        return True
 
         # print(f"Could not sink all ships: sunk={self.ships_sunk}, total={self.total_ships}")
         return False
 
     def sink(self, ar: int, ac: int):
         """Performs a BFS search to completely sink a ship after a hit is found."""
-        queue = deque([(ar, ac)])
-        while queue:
-            i, j = queue.popleft()
-            for ni, nj in [(i+1, j), (i-1, j), (i, j+1), (i, j-1)]:
-                if 0 <= ni < self.board_config.n and 0 <= nj < self.board_config.n and self.board[ni, nj] == 0:
-                    result = self.agent_board.attack(ni, nj)
-                    self.moves += 1
-                    self.board[ni, nj] = 1  # Mark as visited
+        if self.agent_board.sink_attack is not None:
+            # Compiled path: the whole BFS runs without the interpreter
+            moves, ships_sunk = self.agent_board.sink_attack(self.board, ar, ac)
+            self.moves += moves
+            self.ships_sunk += ships_sunk
+            return
 
-                    if result == AttackResult.HIT:
-                        queue.append((ni, nj))
-                    elif result == AttackResult.SUNK:
-                        self.ships_sunk += 1
+        moves, ships_sunk = self._sink_bfs(ar, ac)
+        self.moves += moves
+        self.ships_sunk += ships_sunk
 
     def start_game(self) -> Tuple[int, str]:
         """Runs the optimal battleship algorithm."""
@@ -136,23 +240,26 @@ class RandomAgent(BaseAgent):
     """Randomized Agent"""
     seed: int
 
-    def __init__(self, agent_board: BattleshipAgentBoard, seed: int = 0):
-        super().__init__(agent_board)
+    def __init__(self, agent_board: BattleshipAgentBoard, seed: int = 0, board_buffer: Optional[np.ndarray] = None):
+        super().__init__(agent_board, board_buffer)
         self.seed = seed
-        random.seed(self.seed)
-        self.available_cells = [(r, c) for r in range(self.board_config.n) for c in range(self.board_config.n)]
-        random.shuffle(self.available_cells)  # Shuffle to introduce randomness
+        # Random attack order over the packed cell codes (r * n + c)
+        n = self.board_config.n
+        self._perm = np.random.default_rng(self.seed).permutation(np.arange(n * n, dtype=np.int32))
+        self._next = 0
         self.moves = 0
         self.ships_sunk = 0
         self.total_ships = sum([ship.count for ship in self.board_config.ships])
 
     def seek(self):
         """Selects random positions to attack until all ships are found and sunk."""
-        while self.available_cells and self.ships_sunk < self.total_ships:
-            r, c = self.available_cells.pop()
-            if self.board[r, c] == 0:  # If cell is unvisited
+        n = self.board_config.n
+        while self._next < len(self._perm) and self.ships_sunk < self.total_ships:
+            r, c = divmod(int(self._perm[self._next]), n)
+            self._next += 1
+            if not self.board[r, c]:  # If cell is unvisited
                 result = self.agent_board.attack(r, c)
-                self.board[r, c] = 1  # Mark as visited
+                self.board[r, c] = True
                 self.moves += 1
 
                 if result == AttackResult.HIT:
@@ -162,19 +269,16 @@ class RandomAgent(BaseAgent):
 
     def sink(self, ar: int, ac: int):
         """Performs a BFS search to completely sink a ship after a hit is found."""
-        queue = deque([(ar, ac)])
-        while queue:
-            i, j = queue.popleft()
-            for ni, nj in [(i+1, j), (i-1, j), (i, j+1), (i, j-1)]:
-                if 0 <= ni < self.board_config.n and 0 <= nj < self.board_config.n and self.board[ni, nj] == 0:
-                    result = self.agent_board.attack(ni, nj)
-                    self.board[ni, nj] = 1  # Mark as visited
-                    self.moves += 1
-
-                    if result == AttackResult.HIT:
-                        queue.append((ni, nj))
-                    elif result == AttackResult.SUNK:
-                        self.ships_sunk += 1
+        if self.agent_board.sink_attack is not None:
+            # Compiled path: the whole BFS runs without the interpreter
+            moves, ships_sunk = self.agent_board.sink_attack(self.board, ar, ac)
+            self.moves += moves
+            self.ships_sunk += ships_sunk
+            return
+
+        moves, ships_sunk = self._sink_bfs(ar, ac)
+        self.moves += moves
+        self.ships_sunk += ships_sunk
 
     def start_game(self) -> Tuple[int, str]:
         """Runs the randomized battleship algorithm."""
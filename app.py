@@ -5,7 +5,8 @@ The main app module
 import argparse
 import json
 import os
-from typing import Dict, Tuple
+from multiprocessing import Pool
+from typing import Dict, Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -16,85 +17,121 @@ from board import BattleshipBoard, BattleshipAgentBoard
 from data_types import BoardConfig, ExperimentConfig
 
 
-def run_experiments(config_file: str, agent: str, output_dir: str, seed: int, runs: int):
+def run_experiments(config_file: str, agent: str, output_dir: str, seed: int, runs: int, jobs: Optional[int] = None):
     """
     Method to run multiple experiments
 
+    Every board is an independent game, so boards are played in parallel across
+    {jobs} worker processes (defaults to the number of CPUs).
+
     NOTE: Param {runs} is currently not used
     """
     with open(config_file, "r") as f:
         experiment_config: Dict = json.load(f)
 
     basename = os.path.basename(config_file)
-    result_file = os.path.join(output_dir, f"{agent}_{basename.split('_')[-1]}")
-
-    # Planning to save as json
-    # results = {n: {config: {moves: [], error: [(index, message)]}}}
-    results = {}
-
-
-    for n, configs in tqdm(experiment_config.items(), total=len(experiment_config), desc="N"):
-
-    # rng = np.random.default_rng(seed=seed)
-    # all_n = list(experiment_config.keys())
-    # all_n.sort()
-    # random_n = [all_n[0]] + rng.choice(all_n[1:], size=9, replace=False).tolist()
-    # random_n.sort()
-    # for n in tqdm(random_n, desc="N"):
-    #     configs = experiment_config[n]
-
-
-        results[n] = {}
-        for config, boards in tqdm(configs.items(), total=len(configs), desc="Configs", leave=False):
-            perc = float(config.split("-")[0][1:])
-            min_ship_size = config.split("-")[1][1:]
-            min_ship_size = tuple([int(s) for s in min_ship_size.split("x")])
-
-            # print(f"n={n} | p={perc} | s={min_ship_size} | num_boards={len(boards)}")
-            game_moves = []
-            errors = []
-
-            for i, board_config_dict in tqdm(enumerate(boards), total=len(boards), desc="Board", leave=False):
-                board_config = BoardConfig.from_dict(board_config_dict)
-
-                # We need at least N (board size) vs Moves plot for all 3 agents
-                #
-                # For every N, we have:
-                # 1. (a) Total area of ship approx. 20% of total area of board
-                #    (b) Total area of ship approx. 40% of total area of board
-                # 2. (a) Minimum size ship = 1 x 2
-                #    (b) Minimum size ship = 2 x 3
-                #    (c) Minimum size ship = Random([2,3,4,5]) x Random([2,3,4,5])
-                # In other words, a total of 6 combinations for each N.
-                # For each combination, we have 10 different boards, so we can take avg., std., median, etc.
-
-                moves, err = run_game(board_config, agent, seed)
-                if moves > 0 and len(err) == 0:
-                    game_moves.append(moves)
-                else:
-                    errors.append((i, err))
-
-            results[n][config] = {
-                "moves": game_moves,
-                "errors": errors,
-            }
+    suffix = os.path.splitext(basename.split('_')[-1])[0]
+    result_file = os.path.join(output_dir, f"{agent}_{suffix}.jsonl")
+
+    # Results are streamed as one json line per (n, config), as soon as all its boards are played
+    # {"n": n, "config": config, "moves": [], "errors": [(index, message)]}
+
+    # We need at least N (board size) vs Moves plot for all 3 agents
+    #
+    # For every N, we have:
+    # 1. (a) Total area of ship approx. 20% of total area of board
+    #    (b) Total area of ship approx. 40% of total area of board
+    # 2. (a) Minimum size ship = 1 x 2
+    #    (b) Minimum size ship = 2 x 3
+    #    (c) Minimum size ship = Random([2,3,4,5]) x Random([2,3,4,5])
+    # In other words, a total of 6 combinations for each N.
+    # For each combination, we have 10 different boards, so we can take avg., std., median, etc.
+    tasks = []
+    num_boards: Dict[Tuple[str, str], int] = {}
+    for n, configs in experiment_config.items():
+        for config, boards in configs.items():
+            num_boards[(n, config)] = len(boards)
+            for i, board_config_dict in enumerate(boards):
+                tasks.append((n, config, i, board_config_dict, agent, seed))
 
     os.makedirs(output_dir, exist_ok=True)
     with open(result_file, "w") as f:
-        json.dump(results, f, indent=2)
+        for (n, config), count in num_boards.items():
+            if count == 0:
+                _write_result(f, n, config, {})
+
+        # {(n, config) -> {board index -> (moves, err)}}, only for configs still being played
+        pending: Dict[Tuple[str, str], Dict[int, Tuple[int, str]]] = {}
+        with Pool(processes=jobs) as pool:
+            chunksize = max(1, len(tasks) // (4 * (jobs or os.cpu_count() or 1)))
+            for n, config, i, moves, err in tqdm(pool.imap_unordered(_run_one, tasks, chunksize=chunksize),
+                                                total=len(tasks), desc="Board"):
+                outcomes = pending.setdefault((n, config), {})
+                outcomes[i] = (moves, err)
+                if len(outcomes) == num_boards[(n, config)]:
+                    _write_result(f, n, config, pending.pop((n, config)))
+
     print(f"Results saved in: {result_file}")
 
 
-def run_game(board_config: BoardConfig, agent: str, seed: int = 0) -> Tuple[int, str]:
+def _write_result(f, n: str, config: str, outcomes: Dict[int, Tuple[int, str]]):
+    """Writes the json line of a finished (n, config) of run_experiments()"""
+    game_moves = []
+    errors = []
+    for i in range(len(outcomes)):
+        moves, err = outcomes[i]
+        if moves > 0 and len(err) == 0:
+            game_moves.append(moves)
+        else:
+            errors.append((i, err))
+
+    f.write(json.dumps({"n": n, "config": config, "moves": game_moves, "errors": errors}) + "\n")
+    f.flush()
+
+
+# Agent board buffer of each worker process as (n, buffer), reused across games of the same board size.
+# Tasks come ordered by n, so only the most recent size is kept instead of one buffer per size ever played
+_BOARD_BUFFER: Optional[Tuple[int, np.ndarray]] = None
+
+
+def _get_board_buffer(n: int) -> np.ndarray:
+    """Returns a zeroed agent board buffer for board size {n}"""
+    global _BOARD_BUFFER
+    if _BOARD_BUFFER is not None and _BOARD_BUFFER[0] == n:
+        board_buffer = _BOARD_BUFFER[1]
+        board_buffer.fill(0)
+    else:
+        board_buffer = BaseAgent.make_board_buffer(n)
+        _BOARD_BUFFER = (n, board_buffer)
+    return board_buffer
+
+
+def _run_one(task: Tuple[str, str, int, Dict, str, int]) -> Tuple[str, str, int, int, str]:
+    """Worker for run_experiments(): plays a single experiment board"""
+    n, config, i, board_config_dict, agent, seed = task
+    board_config = BoardConfig.from_dict(board_config_dict)
+    moves, err = run_game(board_config, agent, seed, board_buffer=_get_board_buffer(board_config.n))
+    return n, config, i, moves, err
+
+
+def run_game(
+    board_config: BoardConfig, agent: str, seed: int = 0, board_buffer: Optional[np.ndarray] = None
+) -> Tuple[int, str]:
     game_board = BattleshipBoard(board_config)
-    agent_board = BattleshipAgentBoard(board_config, game_board.get_proxy_API_for_attack())
+    agent_board = BattleshipAgentBoard(
+        board_config,
+        game_board.attack,
+        game_board.attack_many,
+        game_board.get_scan_API_for_attack(),
+        game_board.get_sink_API_for_attack(),
+    )
 
     if agent == "bruteforce":
-        agent: BaseAgent = BruteForceAgent(agent_board=agent_board)
+        agent: BaseAgent = BruteForceAgent(agent_board=agent_board, board_buffer=board_buffer)
     elif agent == "optimal":
-        agent: BaseAgent = OptimalAgent(agent_board=agent_board)
+        agent: BaseAgent = OptimalAgent(agent_board=agent_board, board_buffer=board_buffer)
     elif agent == "random":
-        agent: BaseAgent = RandomAgent(agent_board=agent_board, seed=seed)
+        agent: BaseAgent = RandomAgent(agent_board=agent_board, seed=seed, board_buffer=board_buffer)
     else:
         raise NotImplementedError(f"Unknown agent [{agent}]")
 
@@ -106,7 +143,7 @@ def main(args: argparse.Namespace):
     if args.experiment_file and os.path.exists(args.experiment_file):
         # Experiment mode
         # TODO: Use run_experiments() method
-        run_experiments(args.experiment_file, args.agent, output_dir=args.output_dir, seed=args.seed, runs=args.runs)
+        run_experiments(args.experiment_file, args.agent, output_dir=args.output_dir, seed=args.seed, runs=args.runs, jobs=args.jobs)
         return
 
     if args.config_file and os.path.exists(args.config_file):
@@ -147,6 +184,8 @@ if __name__ == "__main__":
                         help="Output directory")
     parser.add_argument("-r", "--runs", type=int, default=10,
                         help="Number of runs for each experiment")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes for experiments. Defaults to the number of CPUs")
 
     args = parser.parse_args()
     main(args)
@@ -2,64 +2,177 @@
 """
 Module defining the Battleship game board and APIs used by other modules
 """
-from typing import Callable
+from typing import Callable, Optional, Tuple
 
 import numpy as np
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, agents fall back to per-cell attacks
+    njit = None
+
 from data_types import BoardConfig, BoardViewConfig, AttackResult
 
 
+CELL_HIT = -1
+CELL_EMPTY = 0
+
+# AttackResult values used by the array-only kernels
+_MISS = AttackResult.MISS.value
+_HIT = AttackResult.HIT.value
+_SUNK = AttackResult.SUNK.value
+_INVALID = AttackResult.INVALID.value
+
+
+def _attack_cell(board: np.ndarray, ship_cells: np.ndarray, r: int, c: int) -> int:
+    """Array-only BattleshipBoard.attack(), returning the AttackResult value"""
+    v = board[r, c]
+    if v > 0:
+        board[r, c] = CELL_HIT
+        ship_cells[v] -= 1
+        if ship_cells[v] == 0:
+            return _SUNK
+        return _HIT
+    if v == CELL_EMPTY:
+        board[r, c] = CELL_HIT
+        return _MISS
+    if v == CELL_HIT:
+        return _HIT
+    return _INVALID
+
+
+def _scan_attack(board: np.ndarray, ship_cells: np.ndarray, total_ships: int) -> int:
+    """
+    Attack every cell of {board} in row-major order until {total_ships} ships are sunk.
+
+    Returns the number of moves taken, -1 if an invalid cell was attacked, or 0 if the
+    board ran out before all ships sank.
+    """
+    n = board.shape[0]
+    ships_sunk = 0
+    moves = 0
+
+    for r in range(n):
+        for c in range(n):
+            result = _attack_cell(board, ship_cells, r, c)
+            moves += 1
+
+            if result == _SUNK:
+                ships_sunk += 1
+                if ships_sunk == total_ships:
+                    return moves
+            elif result == _INVALID:
+                return -1
+
+    return 0
+
+
+def _sink_visit(board: np.ndarray, ship_cells: np.ndarray, visited: np.ndarray, r: int, c: int) -> int:
+    """Attack cell (r, c) for _sink_bfs() if unvisited. Returns the AttackResult value, 0 if skipped"""
+    if visited[r, c]:
+        return 0
+    visited[r, c] = True
+    return _attack_cell(board, ship_cells, r, c)
+
+
+def _sink_bfs(
+    board: np.ndarray, ship_cells: np.ndarray, visited: np.ndarray, queue: np.ndarray, ar: int, ac: int
+) -> Tuple[int, int, np.ndarray]:
+    """
+    BFS from the hit cell (ar, ac) over the unvisited cells, attacking every cell reached
+    and expanding from the ones that are HIT. Visited cells are marked in the agent's
+    {visited} board. {queue} holds the packed cells (i * n + j) to expand, and is grown
+    when full. Returns the number of moves taken, ships sunk and the (possibly grown) queue.
+    """
+    n = board.shape[0]
+    moves = 0
+    ships_sunk = 0
+
+    queue[0] = ar * n + ac
+    head, tail = 0, 1
+    while head < tail:
+        code = queue[head]
+        head += 1
+        i, j = code // n, code % n
+
+        for k in range(4):
+            if k == 0:
+                if i + 1 >= n:
+                    continue
+                ni, nj, ncode = i + 1, j, code + n
+            elif k == 1:
+                if i == 0:
+                    continue
+                ni, nj, ncode = i - 1, j, code - n
+            elif k == 2:
+                if j + 1 >= n:
+                    continue
+                ni, nj, ncode = i, j + 1, code + 1
+            else:
+                if j == 0:
+                    continue
+                ni, nj, ncode = i, j - 1, code - 1
+
+            result = _sink_visit(board, ship_cells, visited, ni, nj)
+            if result == 0:
+                continue
+            moves += 1
+            if result == _HIT:
+                if tail == len(queue):
+                    grown = np.empty(2 * len(queue), dtype=queue.dtype)
+                    grown[:tail] = queue
+                    queue = grown
+                queue[tail] = ncode
+                tail += 1
+            elif result == _SUNK:
+                ships_sunk += 1
+
+    return moves, ships_sunk, queue
+
+
+if njit is not None:
+    _attack_cell = njit(cache=True, nogil=True)(_attack_cell)
+    _scan_attack = njit(cache=True)(_scan_attack)
+    _sink_visit = njit(cache=True, nogil=True)(_sink_visit)
+    _sink_bfs = njit(cache=True, nogil=True)(_sink_bfs)
+
+
 class BattleshipBoard:
     """Game Board with ships placed on board"""
 
     board_config: BoardConfig
-    board: np.array
+    board: np.ndarray
 
-    CELL_HIT = -1
-    CELL_EMPTY = 0
-    SHIP_CELLS = {}
+    CELL_HIT = CELL_HIT
+    CELL_EMPTY = CELL_EMPTY
+    # Remaining un-hit cells of each ship, indexed by ship id
+    ship_remaining: np.ndarray
+
+    # Initial length of the sink_attack() BFS queue
+    SINK_QUEUE_SIZE = 64
 
     def __init__(self, board_config: BoardConfig):
         self.board_config = board_config
+        n = self.board_config.n
 
-        self.board = np.zeros(shape=(self.board_config.n, self.board_config.n))
-
-        id = 0
-        board_size = self.board_config.n * self.board_config.n
-        total_ship_area = 0
-        min_l = np.inf
-        min_b = np.inf
-        min_l_id = []
-        min_b_id = []
+        board_size = n * n
 
-        for ship_index, ship in enumerate(self.board_config.ships):
-            # make sure number of ships and number of positions in the list match
+        # make sure number of ships and number of positions in the list match
+        for ship in self.board_config.ships:
             if ship.count != len(ship.positions):
                 raise ValueError("Ship count does not match with number of ships")
 
-            total_ship_area += ship.length * ship.breadth * ship.count
-
-            l = min(ship.length, ship.breadth)
-            b = max(ship.length, ship.breadth)
-
-            if l < min_l:
-                min_l = l
-                min_l_id = [ship_index]
-            elif l == min_l:
-                min_l_id.append(ship_index)
-
-            if b < min_b:
-                min_b = b
-                min_b_id = [ship_index]
-            elif b == min_b:
-                min_b_id.append(ship_index)
+        lengths = np.array([ship.length for ship in self.board_config.ships])
+        breadths = np.array([ship.breadth for ship in self.board_config.ships])
+        counts = np.array([ship.count for ship in self.board_config.ships])
+        total_ship_area = int(np.sum(lengths * breadths * counts))
 
         # make sure there exists a ship type with both smallest length and smallest breath
-        is_valid = False
-        for l in min_l_id:
-            if l in min_b_id:
-                is_valid = True
-                break
+        small_sides = np.minimum(lengths, breadths)
+        large_sides = np.maximum(lengths, breadths)
+        is_valid = len(small_sides) > 0 and bool(np.any(
+            (small_sides == small_sides.min()) & (large_sides == large_sides.min())
+        ))
 
         if not is_valid:
             raise ValueError(
@@ -74,58 +187,114 @@ class BattleshipBoard:
         if total_ship_area > board_size:
             raise ValueError("Ships do not all fit on board")
 
-        # Place ships on the board. Use id number to indicate ship
-        for ship in self.board_config.ships:
-            for position in ship.positions:
-                id += 1
-                self.SHIP_CELLS[id] = ship.length * ship.breadth
-                x, y = position
-                # place the ship on the board
-                for i in range(ship.length):
-                    for j in range(ship.breadth):
-                        if x + i < self.board_config.n and y + j < self.board_config.n:
-                            # make sure ships don't overlap
-                            if self.board[x + i, y + j] != 0:
-                                raise ValueError(
-                                    "Ship (id: {id}) overlaps with Ship (id: {self.board[x + i, y + j]})"
-                                )
-                            self.board[x + i, y + j] = id
-                        else:  # make sure ships are all withing bounds of board
-                            raise ValueError(f"Ship (id: {id}, pos: {position}) is out of bounds")
+        # Place ships on the board. Use id number to indicate ship.
+        # Ship k of the (x, y, length, breadth, ship type) boxes gets id k + 1
+        boxes = self.board_config.get_ship_boxes()
+        num_ships = len(boxes)
+
+        # Use the smallest integer type that can hold every ship id
+        dtype = np.int16 if num_ships <= np.iinfo(np.int16).max else np.int32
+        self.board = np.zeros(shape=(n, n), dtype=dtype)
+        self.ship_remaining = np.zeros(num_ships + 1, dtype=np.int32)
+        self.ship_remaining[1:] = boxes[:, 2] * boxes[:, 3]
+        # Only ship cells are queued by sink_attack(), so its queue is kept across calls and grown on demand
+        self._sink_queue = np.empty(self.SINK_QUEUE_SIZE, dtype=np.int32)
+
+        # make sure ships are all withing bounds of board
+        xs, ys, ls, bs = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        out_of_bounds = np.flatnonzero((xs < 0) | (ys < 0) | (xs + ls > n) | (ys + bs > n))
+        if len(out_of_bounds) > 0:
+            k = int(out_of_bounds[0])
+            raise ValueError(f"Ship (id: {k + 1}, pos: {[int(xs[k]), int(ys[k])]}) is out of bounds")
+
+        for id, (x, y, l, b, _) in enumerate(boxes.tolist(), start=1):
+            # make sure ships don't overlap, then place the ship on the board
+            cells = self.board[x:x + l, y:y + b]
+            if cells.any():
+                raise ValueError(
+                    f"Ship (id: {id}) overlaps with Ship (id: {cells[cells != 0][0]})"
+                )
+            cells[...] = id
 
         # print(self.board)
-        # print(self.SHIP_CELLS)
+        # print(self.ship_remaining)
 
     def attack(self, r, c) -> AttackResult:
         """API to hit particular cell on board"""
-        if self.board[r, c] == self.CELL_EMPTY:
+        v = int(self.board[r, c])
+
+        if v > 0:
+            # We hit a ship. Return HIT or SUNK accordingly
+            self.board[r, c] = self.CELL_HIT
+            self.ship_remaining[v] -= 1
+            if self.ship_remaining[v] == 0:
+                return AttackResult.SUNK
+            return AttackResult.HIT
+
+        elif v == self.CELL_EMPTY:
             # no ship was present, return MISS
             self.board[r, c] = self.CELL_HIT
             return AttackResult.MISS
 
-        elif self.board[r, c] == self.CELL_HIT:
+        elif v == self.CELL_HIT:
             # cell already hit, return HIT
             return AttackResult.HIT
 
-        elif self.board[r, c] > 0:
-            # We hit a ship. Return HIT or SUNK accordingly
-            # TODO: Implement logic to return HIT or SUNK
-            ship_id = self.board[r, c]
-            self.board[r, c] = self.CELL_HIT
-            self.SHIP_CELLS[ship_id] -= 1
-            if self.SHIP_CELLS[ship_id] == 0:
-                return AttackResult.SUNK
-            else:
-                return AttackResult.HIT  # Or AttackResult.SUNK
-
         # Should not reach here
         return AttackResult.INVALID
 
-    def get_proxy_API_for_attack(self) -> Callable[[int, int], AttackResult]:
-        def proxy_attack(r: int, c: int) -> AttackResult:
-            return self.attack(r, c)
+    def attack_many(self, rs: np.ndarray, cs: np.ndarray) -> Tuple[np.ndarray, int]:
+        """
+        API to hit the cells (rs[k], cs[k]) in order, vectorized over the whole batch.
+
+        The cells must be distinct. Returns the AttackResult value of every attack as an
+        int8 array, same as calling attack() on each cell in turn, and the number of ships
+        sunk by the batch.
+        """
+        vals = self.board[rs, cs]
+
+        codes = np.full(vals.shape, AttackResult.INVALID.value, dtype=np.int8)
+        codes[vals == self.CELL_EMPTY] = AttackResult.MISS.value
+        codes[(vals == self.CELL_HIT) | (vals > 0)] = AttackResult.HIT.value
+
+        ships_sunk = 0
+        ship_pos = np.flatnonzero(vals > 0)
+        if len(ship_pos) > 0:
+            # A ship sinks on the last of its cells in the batch, if that was its last cell left
+            ship_ids = vals[ship_pos]
+            ids, last, counts = np.unique(ship_ids[::-1], return_index=True, return_counts=True)
+            last = ship_pos[len(ship_pos) - 1 - last]
+            self.ship_remaining[ids] -= counts.astype(np.int32)
+            sunk = self.ship_remaining[ids] == 0
+            codes[last[sunk]] = AttackResult.SUNK.value
+            ships_sunk = int(np.count_nonzero(sunk))
+
+        hit = vals >= self.CELL_EMPTY
+        self.board[rs[hit], cs[hit]] = self.CELL_HIT
+        return codes, ships_sunk
+
+    def scan_attack(self, total_ships: int) -> int:
+        """API to attack all cells in row-major order until {total_ships} ships are sunk"""
+        return _scan_attack(self.board, self.ship_remaining, total_ships)
+
+    def sink_attack(self, visited: np.ndarray, ar: int, ac: int) -> Tuple[int, int]:
+        """API to sink the ship hit at (ar, ac) with a BFS over cells not yet set in the agent's {visited} board"""
+        moves, ships_sunk, self._sink_queue = _sink_bfs(
+            self.board, self.ship_remaining, visited, self._sink_queue, ar, ac
+        )
+        return int(moves), int(ships_sunk)
+
+    def get_scan_API_for_attack(self) -> Optional[Callable[[int], int]]:
+        """Returns the compiled row-major scan API, or None when numba is unavailable"""
+        if njit is None:
+            return None
+        return self.scan_attack
 
-        return proxy_attack
+    def get_sink_API_for_attack(self) -> Optional[Callable[[np.ndarray, int, int], Tuple[int, int]]]:
+        """Returns the compiled BFS sink API, or None when numba is unavailable"""
+        if njit is None:
+            return None
+        return self.sink_attack
 
 
 class BattleshipAgentBoard:
@@ -133,12 +302,23 @@ class BattleshipAgentBoard:
 
     board_config: BoardViewConfig
     attack: Callable[[int, int], AttackResult]
+    attack_many: Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, int]]
+    scan_attack: Optional[Callable[[int], int]]
+    sink_attack: Optional[Callable[[np.ndarray, int, int], Tuple[int, int]]]
 
     def __init__(
-        self, board_config: BoardConfig, attack_fn: Callable[[int, int], AttackResult]
+        self,
+        board_config: BoardConfig,
+        attack_fn: Callable[[int, int], AttackResult],
+        attack_many_fn: Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, int]],
+        scan_fn: Optional[Callable[[int], int]] = None,
+        sink_fn: Optional[Callable[[np.ndarray, int, int], Tuple[int, int]]] = None,
     ):
         self.board_config = board_config.get_board_view()
         self.attack = attack_fn
+        self.attack_many = attack_many_fn
+        self.scan_attack = scan_fn
+        self.sink_attack = sink_fn
 
     # def attack(self, r: int, c: int) -> AttackResult:
     #     return self.attack(r, c)
@@ -4,12 +4,14 @@ Module describing different data types
 """
 import json
 
-from enum import Enum, auto
+from enum import IntEnum, auto
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
+import numpy as np
 
-@dataclass
+
+@dataclass(slots=True)
 class ShipView():
     """View of Ship for Agent in Battleship game"""
     length: int
@@ -17,14 +19,14 @@ class ShipView():
     count: int
 
 
-@dataclass
+@dataclass(slots=True)
 class BoardViewConfig():
     """Battleship Game Board view for Agent"""
     n: int
     ships: List[ShipView]
 
 
-@dataclass
+@dataclass(slots=True)
 class Ship():
     """Ship in Battleship game"""
     length: int
@@ -48,7 +50,7 @@ class Ship():
         return ShipView(self.length, self.breadth, self.count)
 
 
-@dataclass
+@dataclass(slots=True)
 class BoardConfig():
     """Game Board for a Battleship game"""
     n: int
@@ -62,14 +64,7 @@ class BoardConfig():
 
     @classmethod
     def from_dict(cls, config: Dict[str, Any]) -> "BoardConfig":
-        n = config["n"]
-
-        ships: List[Ship] = [None] * len(config["ships"])
-
-        for i, ship in enumerate(config["ships"]):
-            ships[i] = Ship.from_dict(ship)
-
-        return cls(n, ships)
+        return cls(config["n"], [Ship.from_dict(ship) for ship in config["ships"]])
 
     def to_json(self, output_file: str):
         with open(output_file, "w") as f:
@@ -81,17 +76,29 @@ class BoardConfig():
             "ships": [ship.to_dict() for ship in self.ships]
         }
 
+    def get_ship_boxes(self) -> np.ndarray:
+        """
+        All placed ships as a (num_ships, 5) int32 array of rows
+        (x, y, length, breadth, ship type index), in the order of {ships} and their positions.
+        """
+        boxes = [
+            [x, y, ship.length, ship.breadth, ship_index]
+            for ship_index, ship in enumerate(self.ships)
+            for x, y in ship.positions
+        ]
+        return np.array(boxes, dtype=np.int32).reshape(-1, 5)
+
     def get_board_view(self):
         return BoardViewConfig(self.n, [ship.get_ship_view() for ship in self.ships])
 
 
-class AttackResult(Enum):
+class AttackResult(IntEnum):
     HIT = auto()
     MISS = auto()
     SUNK = auto()
     INVALID = auto()
 
-@dataclass
+@dataclass(slots=True)
 class ExperimentConfig():
     boards: List[BoardConfig]
     runs_per_board: int
@@ -3,14 +3,20 @@
 Module to generate random boards for experimentation purposes
 """
 import argparse
+import itertools
 import json
 import os
 import random
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Tuple
 
 import numpy as np
 from tqdm import tqdm, trange
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, ships are then placed from Python
+    njit = None
+
 from data_types import BoardConfig, Ship
 
 
@@ -19,41 +25,130 @@ DEBUG = False
 RNG = np.random.default_rng(seed=13)
 
 
-def write_boards_to_json(boards_data: Dict[int, Dict[str, List[BoardConfig]]], filepath: str):
-    out_data = {
-        k1: {
-            k2: [board.to_dict() for board in v2]
-            for k2, v2 in v1.items()
-        }
-        for k1, v1 in boards_data.items()
-    }
+class BoardConfigEncoder(json.JSONEncoder):
+    """JSON encoder serializing BoardConfig objects as they are reached"""
+
+    def default(self, o):
+        if isinstance(o, BoardConfig):
+            return o.to_dict()
+        return super().default(o)
+
 
+def write_boards_to_json(boards_data: Dict[int, Dict[str, List[BoardConfig]]], filepath: str):
+    # Written one board size at a time, without indentation: json.dumps() then runs on the
+    # C encoder, and only a single board size is ever held as a string
     with open(filepath, "w") as f:
-        json.dump(out_data, f, indent=2)
+        f.write("{")
+        for i, (n, configs) in enumerate(boards_data.items()):
+            if i > 0:
+                f.write(",")
+            f.write(f"\n{json.dumps(str(n))}: ")
+            f.write(json.dumps(configs, cls=BoardConfigEncoder))
+        f.write("\n}\n")
+
+
+class _UniformPool:
+    """
+    Uniform [0, 1) draws from RNG, generated a batch at a time so that ship placement
+    does not pay one RNG call per try. Draws that were not used are handed out again.
+    """
+
+    BATCH = 1024
+
+    def __init__(self):
+        self.values = np.empty(0)
+        self.next = 0
+
+    def peek(self, size: int) -> np.ndarray:
+        if len(self.values) - self.next < size:
+            self.values = np.concatenate((self.values[self.next:], RNG.random(max(self.BATCH, size))))
+            self.next = 0
+        return self.values[self.next:self.next+size]
+
+    def advance(self, size: int):
+        self.next += size
+
+
+_UNIFORMS = _UniformPool()
 
 
 def place_ship_on_board(board: np.ndarray, ship_size: Tuple[int, int], count: int = 1) -> List[List[int]]:
     n = board.shape[0]
-    positions: List[List[int]] = []
+    # The compiled _place_ship() does no bounds checks, so a ship that cannot fit must not reach it
+    if ship_size[0] > n or ship_size[1] > n:
+        raise ValueError(f"Ship of size {ship_size[0]}x{ship_size[1]} does not fit on a {n}x{n} board")
+
+    # Every placed ship takes at most 10 tries, and the last failing ship 10 more
+    max_tries = 10 * (count + 1)
+    uniforms = _UNIFORMS.peek(2 * max_tries)
+    rand_rows = (uniforms[0::2] * (n - ship_size[0] + 1)).astype(np.int64)
+    rand_cols = (uniforms[1::2] * (n - ship_size[1] + 1)).astype(np.int64)
+
+    positions, tries = _place_ship(board, ship_size[0], ship_size[1], count, rand_rows, rand_cols)
+
+    # Only the candidates actually tried are consumed
+    _UNIFORMS.advance(2 * tries)
+    return positions.tolist()
+
+
+def _is_free(board: np.ndarray, row: int, col: int, sh: int, sw: int) -> bool:
+    """Checks that the {sh}x{sw} region of {board} at (row, col) holds no ship, stopping at the first occupied cell"""
+    for i in range(row, row+sh):
+        for j in range(col, col+sw):
+            if board[i, j]:
+                return False
+    return True
+
+
+def _place_ship(board: np.ndarray, sh: int, sw: int, count: int,
+                rand_rows: np.ndarray, rand_cols: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Places up to {count} ships of size {sh}x{sw} on {board}, trying the candidate cells
+    (rand_rows[k], rand_cols[k]) in order. Gives up after 10 failed tries in a row.
+    Returns the (row, col) positions of the placed ships and the number of tries.
+    """
+    positions = np.empty((count, 2), dtype=np.int64)
+    placed = 0
 
     tries = 0
-    while len(positions) < count and tries < 10:
-        # row, col = RNG.integers(0, n, size=2)
-        row = RNG.integers(0, n-ship_size[0], endpoint=True, dtype=int)
-        col = RNG.integers(0, n-ship_size[1], endpoint=True, dtype=int)
+    k = 0
+    while placed < count and tries < 10:
+        row = rand_rows[k]
+        col = rand_cols[k]
+        k += 1
         tries += 1
 
-        if row + ship_size[0] > n or col + ship_size[1] > n:
+        if not _is_free(board, row, col, sh, sw):
             continue
 
-        if np.any(board[row:row+ship_size[0], col:col+ship_size[1]]):
-            continue
-
-        board[row:row+ship_size[0], col:col+ship_size[1]] = 1
-        positions.append([row, col])
+        board[row:row+sh, col:col+sw] = True
+        positions[placed, 0] = row
+        positions[placed, 1] = col
+        placed += 1
         tries = 0
 
-    return positions
+    return positions[:placed], k
+
+
+if njit is not None:
+    _is_free = njit(cache=True)(_is_free)
+    _place_ship = njit(cache=True)(_place_ship)
+
+
+def _biased_choices(values: List[int], alpha: float, batch: int = 1024) -> Iterator[int]:
+    """
+    Endless stream of RNG draws from {values}: values[0] with probability {alpha}, otherwise
+    one of the remaining values uniformly. Same distribution as
+    RNG.choice(values, p=[alpha] + [(1-alpha)/(k-1)]*(k-1)), but drawn {batch} at a time.
+    """
+    if len(values) == 1:
+        yield from itertools.repeat(values[0])
+
+    values_arr = np.asarray(values)
+    while True:
+        first = RNG.random(batch) < alpha
+        indices = np.where(first, 0, RNG.integers(1, len(values), size=batch))
+        yield from values_arr[indices].tolist()
 
 
 def generate_boards(n: int, ship_area_percentage: float, min_ship_size: Tuple[int, int], num_boards: int=1) -> List[BoardConfig]:
@@ -73,22 +168,18 @@ def generate_boards(n: int, ship_area_percentage: float, min_ship_size: Tuple[in
     l_range = list(range(min_ship_size[0], max_ship_lsize+1))
     b_range = list(range(min_ship_size[1], max_ship_bsize+1))
     alpha = 0.4
-    if len(l_range) == 1:
-        l_probs = [1.0]
-    else:
-        l_probs = [alpha] + ([(1-alpha)/(len(l_range) - 1)]*(len(l_range) - 1))
+    l_choices = _biased_choices(l_range, alpha)
+    b_choices = _biased_choices(b_range, alpha)
 
-    if len(b_range) == 1:
-        b_probs = [1.0]
-    else:
-        b_probs = [alpha] + ([(1-alpha)/(len(b_range) - 1)]*(len(b_range) - 1))
+    # Occupancy board, reused across the boards of this config
+    game_board = np.zeros((n, n), dtype=np.bool_)
 
     for _ in range(num_boards):
         ships: List[Ship] = []
 
         ship_area = 0.0
         total_ships = 0
-        game_board = np.zeros((n, n), dtype=np.int32)
+        game_board.fill(0)
 
         count = 1 if RNG.random() < 0.5 else 2
 
@@ -111,8 +202,8 @@ def generate_boards(n: int, ship_area_percentage: float, min_ship_size: Tuple[in
 
             # l = int(RNG.integers(min_ship_size[0], max_ship_lsize, endpoint=True))
             # b = int(RNG.integers(min_ship_size[1], max_ship_bsize, endpoint=True))
-            l = int(RNG.choice(l_range, p=l_probs))
-            b = int(RNG.choice(b_range, p=b_probs))
+            l = next(l_choices)
+            b = next(b_choices)
             ship_size = (l, b)
             if ship_size == min_ship_size and (len(l_range) > 1 or len(b_range) > 1):
                 infty_loop_counter += 1
@@ -123,7 +214,7 @@ def generate_boards(n: int, ship_area_percentage: float, min_ship_size: Tuple[in
 
                 # Gets stuck in infinity loop if following unused statement is removed
                 # Maybe some issue with random generator that randomly keeps generating same number.
-                _ = int(RNG.choice(l_range, p=l_probs))
+                _ = next(l_choices)
 
                 continue
 
@@ -2,190 +2,275 @@
 """
 Module to plot results
 """
-import json
+import argparse
+import mmap
 import os
-from typing import Dict, List, Tuple
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 
+try:
+    from orjson import loads as json_loads
+    _LOADS_BUFFERS = True  # orjson parses straight out of a memoryview, no bytes copy needed
+except ImportError:  # orjson is optional, fall back to the (slower) stdlib parser
+    from json import loads as json_loads
+    _LOADS_BUFFERS = False
+
 
 plt.rcParams.update({'font.size': 16})
 
 
-def plot_for_board_size(brute_force_data_files: List[str], optimal_data_files: List[str], random_data_files: List[str]):
-    """Only use p0.20-s1x2 config"""
-    CONFIG_NAMES = ["p0.20-s1x2"]
-
-    def extract_results(data_files: Dict) -> Dict[int, List[int]]:
-        results = {}
-        for result_file in data_files:
-            with open(result_file, "r") as f:
-                data: Dict = json.load(f)
-
-            for n, configs in data.items():
-                for config, result in configs.items():
-                    if config not in CONFIG_NAMES:
-                        continue
-                    results[int(n)] = result["moves"]
-        return results
-
-    # {N -> [Moves]}
-    bruteforce = extract_results(brute_force_data_files)
-    optimal = extract_results(optimal_data_files)
-    randomized = extract_results(random_data_files)
-
-    datasets = [bruteforce, optimal, randomized]
-    names = ["BruteForce", "Our Algo", "Randomized"]
-
-    for name, dataset in zip(names, datasets):
-        n = list(dataset.keys())
-        n.sort()
-        avg_moves = [np.mean(dataset[i]) for i in n]
-        median_moves = [np.median(dataset[i]) for i in n]
-        plt.plot(n, avg_moves, label=name)
+def _is_fresh(cache_file: str, result_file: str) -> bool:
+    """Whether {cache_file} exists and is not older than the {result_file} it was built from"""
+    return os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(result_file)
+
+
+def _parse_results(result_file: str) -> Dict:
+    """
+    Parses an agent's results file as {n: {config: result}}.
+
+    Supports both the nested .json files and the .jsonl files streamed by
+    app.run_experiments(), which hold one {"n", "config", "moves", "errors"} record per line.
+    """
+    with open(result_file, "rb") as f:
+        if not result_file.endswith(".jsonl"):
+            if not _LOADS_BUFFERS or os.fstat(f.fileno()).st_size == 0:  # empty files cannot be mapped
+                return json_loads(f.read())
+            # Parse from the page cache mapping rather than reading the file into a bytes object first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                return json_loads(view)
+
+        data: Dict = {}
+        for line in f:
+            if not line.strip():
+                continue
+            record = json_loads(line)
+            data.setdefault(str(record["n"]), {})[record["config"]] = {
+                "moves": record["moves"],
+                "errors": record["errors"],
+            }
+        return data
+
+
+def _mean_moves(moves: np.ndarray) -> float:
+    """Mean number of moves over the games of one (N, config) result"""
+    return moves.mean() if moves.shape[0] else np.nan
+
+
+def _show_or_save(output_file: Optional[str]):
+    """Shows the current figure, or renders it to {output_file} and closes it when one is given"""
+    if output_file is None:
+        plt.show()
+        return
+    plt.savefig(output_file, dpi=120)
+    plt.close()
+
+
+ALGO_NAMES = ["BruteForce", "Our Algo", "Randomized"]
+# Agent name of each of ALGO_NAMES, as used in the results and plot file names
+ALGO_KEYS = ["bruteforce", "optimal", "random"]
+# Config names are "p<area fraction>-s<l_a>x<b_a>", e.g. "p0.20-s1x2"
+_CFG_RE = re.compile(r"p(\d+(?:\.\d+)?)-s(\d+)x(\d+)")
+
+
+# One record per (N, config) of a results file, area in %
+RESULT_DTYPE = np.dtype([
+    ("n", np.int32), ("area", np.int16), ("ship_l", np.int16), ("ship_b", np.int16), ("mean_moves", np.float64),
+])
+
+
+def summarize_results(data: Dict) -> np.ndarray:
+    """
+    Reduces one loaded results file to a RESULT_DTYPE record per config,
+    so its raw move lists can be dropped as soon as it is read
+    """
+    rows = np.empty(sum(len(configs) for configs in data.values()), dtype=RESULT_DTYPE)
+    num_rows = 0
+    for n, configs in data.items():
+        for config, result in configs.items():
+            m = _CFG_RE.fullmatch(config)
+            if m is None:
+                continue
+            area = round(float(m[1])*100)
+            # A game takes at most N*N moves, which fits int32; np.mean still accumulates in float64
+            rows[num_rows] = (int(n), area, int(m[2]), int(m[3]),
+                              _mean_moves(np.asarray(result["moves"], dtype=np.int32)))
+            num_rows += 1
+    return rows[:num_rows]
+
+
+# Version of the load_summary() sidecar layout; bump it whenever RESULT_DTYPE changes
+SUMMARY_VERSION = 1
+
+
+def load_summary(result_file: str) -> np.ndarray:
+    """
+    summarize_results() of {result_file}. The plots only ever need these per-config means, so they are
+    saved to a .summary.v<SUMMARY_VERSION>.npy sidecar that later runs load instead of the whole results file
+    """
+    cache_file = f"{result_file}.summary.v{SUMMARY_VERSION}.npy"
+    if _is_fresh(cache_file, result_file):
+        try:
+            rows = np.load(cache_file)
+            if rows.dtype == RESULT_DTYPE:
+                return rows
+        except (OSError, ValueError, EOFError):  # e.g. a cache truncated by an interrupted run; rebuild it below
+            pass
+
+    rows = summarize_results(_parse_results(result_file))
+    # Write to a temporary file first, so an interrupted run never leaves a partial sidecar behind
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            np.save(f, rows)
+        os.replace(tmp_file, cache_file)
+    except OSError:  # e.g. a read-only data dir; just summarize again next time
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+    return rows
+
+
+def build_results_frame(brute_force_rows: List[np.ndarray], optimal_rows: List[np.ndarray],
+                        random_rows: List[np.ndarray]) -> pd.DataFrame:
+    """
+    Combines the summarize_results() records of every file of every algorithm into one table with a row per
+    (algo, N, config): columns algo, n, area, ship_l, ship_b and mean_moves.
+
+    Where several files have the same (algo, N, config), the one later in its *_rows list wins,
+    so pass the files in the order they should override each other.
+    """
+    algo_rows = [np.concatenate([np.empty(0, dtype=RESULT_DTYPE), *files_rows])
+                 for files_rows in [brute_force_rows, optimal_rows, random_rows]]
+    algo_codes = np.repeat(np.arange(len(ALGO_NAMES), dtype=np.int8), [len(rows) for rows in algo_rows])
+
+    df = pd.DataFrame(np.concatenate(algo_rows))
+    # Categorical keeps the algorithms in plotting order when grouping
+    df.insert(0, "algo", pd.Categorical.from_codes(algo_codes, categories=ALGO_NAMES, ordered=True))
+    # Later files override earlier ones for the same (algo, N, config)
+    return df.drop_duplicates(["algo", "n", "area", "ship_l", "ship_b"], keep="last")
+
+
+def _plot_moves(results: pd.DataFrame, group_cols: List[str], label_fmt: Callable[..., str], title: str,
+                output_file: Optional[str] = None, left: float = 0.07):
+    """
+    Plots N vs mean moves with one series per algorithm and combination of {group_cols} values.
+    Series are labeled by label_fmt(algo_name, *group values).
+    """
+    by = ["algo", *group_cols]
+
+    # fig, axes = plt.subplots(3, 1)
+    for keys, group in results.groupby(by, observed=True):
+        group = group.sort_values("n")
+        plt.plot(group["n"].to_numpy(), group["mean_moves"].to_numpy(), label=label_fmt(*keys))
 
     # plt.xscale("log", base=2)
     # plt.yscale("log", base=2)
     plt.xlabel("Board Size $N$")
     plt.ylabel("Num moves to finish the game")
-    plt.subplots_adjust(left=0.06, bottom=0.08, right=0.97, top=0.95)
-    plt.title("Board Size $N$ vs Num moves")
+    plt.subplots_adjust(left=left, bottom=0.08, right=0.97, top=0.95)
+    plt.title(title)
     plt.legend()
     plt.grid(True)
-    plt.show()
+    _show_or_save(output_file)
 
 
-def plot_for_area(brute_force_data_files: List[str], optimal_data_files: List[str], random_data_files: List[str]):
-    """Only use 1x2 ship size config"""
-    SHIP_SIZE = "-s1x2"
-
-    def extract_results(data_files: Dict) -> Dict[int, Dict[int, List[int]]]:
-        results = {}
-        for result_file in data_files:
-            with open(result_file, "r") as f:
-                data: Dict = json.load(f)
-
-            for n, configs in data.items():
-                for config, result in configs.items():
-                    if SHIP_SIZE not in config:
-                        continue
-                    perc = float(config.split("-")[0][1:])
-                    area = round(perc*100)
-                    if area not in results:
-                        results[area] = {}
-                    results[area][int(n)] = result["moves"]
-        return results
-
-    # {Area -> {N -> [Moves]}}
-    bruteforce = extract_results(brute_force_data_files)
-    optimal = extract_results(optimal_data_files)
-    randomized = extract_results(random_data_files)
-
-    datasets = [bruteforce, optimal, randomized]
-    names = ["BruteForce", "Our Algo", "Randomized"]
+def plot_for_board_size(results: pd.DataFrame, output_file: Optional[str] = None):
+    """Only use p0.20-s1x2 config"""
+    results = results[(results["area"] == 20) & (results["ship_l"] == 1) & (results["ship_b"] == 2)]
+    _plot_moves(results, [], lambda name: name, "Board Size $N$ vs Num moves", output_file, left=0.06)
 
-    # fig, axes = plt.subplots(3, 1)
-    for algo_id, (name, dataset) in enumerate(zip(names, datasets)):
-        areas = list(dataset.keys())
-        areas.sort()
-
-        for area in areas:
-            n = list(dataset[area].keys())
-            n.sort()
-
-            avg_moves = [np.mean(dataset[area][i]) for i in n]
-            median_moves = [np.median(dataset[area][i]) for i in n]
-            plt.plot(n, avg_moves, label=f"{name}; $A_S$ = {area}%")
-
-        # plt.xscale("log", base=2)
-        # plt.yscale("log", base=2)
-        plt.xlabel("Board Size $N$")
-        plt.ylabel("Num moves to finish the game")
-        plt.subplots_adjust(left=0.07, bottom=0.08, right=0.97, top=0.95)
-        plt.title("Area covered by Ships $A_S$ vs Num moves")
-        plt.legend()
-        plt.grid(True)
-        plt.show()
+
+def _plot_per_algo(results: pd.DataFrame, group_cols: List[str], label_fmt: Callable[..., str], title: str,
+                   output_prefix: Optional[str] = None):
+    """_plot_moves() with a separate figure for every algorithm, saved as {output_prefix}-<agent>.png if given"""
+    for name, key in zip(ALGO_NAMES, ALGO_KEYS):
+        algo_results = results[results["algo"] == name]
+        if algo_results.empty:
+            continue
+        output_file = None if output_prefix is None else f"{output_prefix}-{key}.png"
+        _plot_moves(algo_results, group_cols, label_fmt, title, output_file)
 
 
-def plot_for_ship_size(brute_force_data_files: List[str], optimal_data_files: List[str], random_data_files: List[str]):
+def plot_for_area(results: pd.DataFrame, output_prefix: Optional[str] = None):
     """Only use 1x2 ship size config"""
-    AREA_PERCENTAGE = "p0.20-"
+    results = results[(results["ship_l"] == 1) & (results["ship_b"] == 2)]
+    _plot_per_algo(results, ["area"], lambda name, area: f"{name}; $A_S$ = {area}%",
+                   "Area covered by Ships $A_S$ vs Num moves", output_prefix)
+
+
+def plot_for_ship_size(results: pd.DataFrame, output_prefix: Optional[str] = None):
+    """Only use p0.20 area config"""
     SHIP_SIZES = [(1, 2), (2, 3), (3, 5)]
 
-    def extract_results(data_files: Dict) -> Dict[int, Dict[int, List[int]]]:
-        results = {}
-        for result_file in data_files:
-            with open(result_file, "r") as f:
-                data: Dict = json.load(f)
-
-            for n, configs in data.items():
-                for config, result in configs.items():
-                    if AREA_PERCENTAGE not in config:
-                        continue
-                    min_ship_size = config.split("-")[1][1:]
-                    min_ship_size = tuple([int(s) for s in min_ship_size.split("x")])
-                    if min_ship_size not in SHIP_SIZES:
-                        continue
-                    if min_ship_size not in results:
-                        results[min_ship_size] = {}
-                    results[min_ship_size][int(n)] = result["moves"]
-        return results
-
-    # {(l_a, b_a) -> {N -> [Moves]}}
-    bruteforce = extract_results(brute_force_data_files)
-    optimal = extract_results(optimal_data_files)
-    randomized = extract_results(random_data_files)
-
-    datasets = [bruteforce, optimal, randomized]
-    names = ["BruteForce", "Our Algo", "Randomized"]
+    keep = np.zeros(len(results), dtype=bool)
+    for l_a, b_a in SHIP_SIZES:
+        keep |= (results["ship_l"] == l_a).to_numpy() & (results["ship_b"] == b_a).to_numpy()
+    results = results[keep & (results["area"] == 20).to_numpy()]
+    _plot_per_algo(results, ["ship_l", "ship_b"], lambda name, l_a, b_a: f"{name}; $S_a$ = ({l_a}, {b_a})",
+                   "Min Ship Size $S_a = (l_a, b_a)$ vs Num moves", output_prefix)
 
-    # fig, axes = plt.subplots(3, 1)
-    for algo_id, (name, dataset) in enumerate(zip(names, datasets)):
-        ship_sizes = list(dataset.keys())
-        ship_sizes.sort()
-
-        for size in ship_sizes:
-            n = list(dataset[size].keys())
-            n.sort()
-
-            avg_moves = [np.mean(dataset[size][i]) for i in n]
-            median_moves = [np.median(dataset[size][i]) for i in n]
-            plt.plot(n, avg_moves, label=f"{name}; $S_a$ = {size}")
-
-        # plt.xscale("log", base=2)
-        # plt.yscale("log", base=2)
-        plt.xlabel("Board Size $N$")
-        plt.ylabel("Num moves to finish the game")
-        plt.subplots_adjust(left=0.07, bottom=0.08, right=0.97, top=0.95)
-        plt.title("Min Ship Size $S_a = (l_a, b_a)$ vs Num moves")
-        plt.legend()
-        plt.grid(True)
-        plt.show()
 
+def main(args: argparse.Namespace):
+    if not args.interactive:
+        # Only rendering to files, so skip the GUI backend and its event loop altogether
+        plt.switch_backend("Agg")
+        # The subplots_adjust() margins are tuned for a maximized window, so render at about that size
+        plt.rcParams["figure.figsize"] = (16, 9)
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    def output_path(name: str) -> Optional[str]:
+        return None if args.interactive else os.path.join(args.output_dir, name)
 
-def main():
     data_dirs = ["./data/outputs", "./data/outputs-fixed"]
-    brute_force_data_files = [
-        f.path for data_dir in data_dirs
-        for f in os.scandir(data_dir) if "bruteforce" in f.name
-    ]
-    optimal_data_files = [
-        f.path for data_dir in data_dirs
-        for f in os.scandir(data_dir) if "optimal" in f.name
-    ]
-    random_data_files = [
-        f.path for data_dir in data_dirs
-        for f in os.scandir(data_dir) if "random" in f.name
-    ]
-
-    # plot_for_board_size(brute_force_data_files, optimal_data_files, random_data_files)
-    plot_for_area(brute_force_data_files, optimal_data_files, random_data_files)
-    plot_for_ship_size(brute_force_data_files, optimal_data_files, random_data_files)
+    # Skip the .summary.v*.npy caches written by load_summary() next to the results files
+    result_exts = (".json", ".jsonl")
+    brute_force_data_files, optimal_data_files, random_data_files = [], [], []
+    for data_dir in data_dirs:
+        # Sorted so that the override order of build_results_frame() does not depend on the scandir order
+        for f in sorted(os.scandir(data_dir), key=lambda f: f.name):
+            if not f.name.endswith(result_exts):
+                continue
+            # app.run_experiments() now writes <agent>_<suffix>.jsonl, so a .json of the same stem is stale
+            if f.name.endswith(".json") and os.path.exists(f.path + "l"):
+                continue
+            if "bruteforce" in f.name:
+                brute_force_data_files.append(f.path)
+            elif "optimal" in f.name:
+                optimal_data_files.append(f.path)
+            elif "random" in f.name:
+                random_data_files.append(f.path)
+
+    # Load every file's per-config means once up front.
+    # The files are independent, so load them concurrently to overlap their disk reads
+    with ThreadPoolExecutor() as executor:
+        brute_force_rows = executor.map(load_summary, brute_force_data_files)
+        optimal_rows = executor.map(load_summary, optimal_data_files)
+        random_rows = executor.map(load_summary, random_data_files)
+        brute_force_rows, optimal_rows, random_rows = list(brute_force_rows), list(optimal_rows), list(random_rows)
+    # Every plot is a slice of this one table
+    results = build_results_frame(brute_force_rows, optimal_rows, random_rows)
+
+    # Saved with the same names as the plots in images/
+    # plot_for_board_size(results, output_path("board-size.png"))
+    plot_for_area(results, output_path("area"))
+    plot_for_ship_size(results, output_path("ship-size"))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-o", "--output_dir", type=str, default="./data/plots",
+                        help="Directory the plots are saved to as .png files, named like the ones in images/")
+    parser.add_argument("-i", "--interactive", action="store_true",
+                        help="Show each plot in a GUI window instead of saving it")
+
+    args = parser.parse_args()
+    main(args)